@@ -1,11 +1,164 @@
+import os
+import time
+import hashlib
 import streamlit as st
 import json
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
-from gigachat_client import gigachat_client
+from gigachat_client import GigaChatClient
 from plantuml_generator import render_plantuml
 
+# orjson разбирает JSON заметно быстрее стандартного модуля, но не обязателен
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
+SYSTEM_PROMPT_PATH = os.path.join("prompts", "system_prompt.txt")
+
+
+@st.cache_data(show_spinner=False)
+def _read_system_prompt(path: str, mtime: float) -> str:
+    """Читает системный промпт; mtime входит в ключ кэша, чтобы правки файла подхватывались"""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_system_prompt() -> str:
+    """Возвращает системный промпт, читая файл с диска только при его изменении"""
+    return _read_system_prompt(SYSTEM_PROMPT_PATH, os.path.getmtime(SYSTEM_PROMPT_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_gigachat_client() -> GigaChatClient:
+    """Единственный экземпляр клиента GigaChat на процесс, общий для всех перезапусков и сессий"""
+    return GigaChatClient()
+
+
+RESPONSE_CACHE_TTL = 3600
+# Частичный ответ перерисовывается не чаще раза за столько секунд: каждая
+# перерисовка отправляет в браузер весь накопленный текст
+STREAM_REFRESH_INTERVAL = 0.1
+# Больше ответов не хранится: самые давние вытесняются
+RESPONSE_CACHE_MAX_SIZE = 128
+
+
+@st.cache_resource(show_spinner=False)
+def _response_cache() -> tuple:
+    """
+    Общий для всех сессий кэш ответов модели и его блокировка
+
+    Кэш: ключ -> (время получения, текст ответа), от давно использованных к недавним
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def _cached_response(cache_key: str):
+    """Ответ из кэша или None; просроченная запись удаляется"""
+    cache, lock = _response_cache()
+    with lock:
+        cached = cache.get(cache_key)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] >= RESPONSE_CACHE_TTL:
+            del cache[cache_key]
+            return None
+        cache.move_to_end(cache_key)
+        return cached[1]
+
+
+def _store_response(cache_key: str, content: str):
+    """Сохраняет ответ, удаляя просроченные записи и вытесняя давние сверх лимита"""
+    cache, lock = _response_cache()
+    now = time.monotonic()
+    with lock:
+        for key in [key for key, (stored_at, _) in cache.items() if now - stored_at >= RESPONSE_CACHE_TTL]:
+            del cache[key]
+        cache[cache_key] = (now, content)
+        cache.move_to_end(cache_key)
+        while len(cache) > RESPONSE_CACHE_MAX_SIZE:
+            cache.popitem(last=False)
+
+
+def stream_chat_completion(messages: list, model: str, temperature: float, placeholder) -> str:
+    """
+    Возвращает текст ответа модели, показывая его в placeholder по мере генерации
+
+    Ответ на уже отправленный набор (messages, model, temperature) берется из кэша без запроса к API
+    """
+    digest = hashlib.blake2b(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    cache_key = f"{digest}:{model}:{temperature}"
+    cached = _cached_response(cache_key)
+    if cached is not None:
+        return cached
+
+    chunks = []
+    next_refresh = 0.0
+    try:
+        for chunk in get_gigachat_client().chat_completion_stream(
+            messages=messages,
+            model=model,
+            temperature=temperature
+        ):
+            chunks.append(chunk)
+            now = time.monotonic()
+            if now >= next_refresh:
+                next_refresh = now + STREAM_REFRESH_INTERVAL
+                placeholder.code("".join(chunks), language="json")
+    except BaseException:
+        # Оборванный частичный JSON не остается на странице
+        placeholder.empty()
+        raise
+
+    content = "".join(chunks)
+    _store_response(cache_key, content)
+    return content
+
+
+def parse_model_json(content: str) -> dict:
+    """
+    Разбирает JSON ответ модели, предварительно убирая обрамление ```json ... ```
+
+    Raises:
+        json.JSONDecodeError: Если ответ не является корректным JSON
+    """
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.split("```", 2)[1]
+        if text.startswith("json"):
+            text = text[len("json"):]
+        text = text.strip()
+    if orjson is not None:
+        try:
+            return orjson.loads(text.encode("utf-8"))
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+@st.cache_data(show_spinner=False)
+def build_report(title: str, bpmn_code: str, usecase_code: str, requirements_md: str) -> str:
+    """Собирает Markdown отчет по результатам анализа"""
+    return f"""# Анализ системы: {title}
+
+## BPMN диаграмма процесса
+```plantuml
+{bpmn_code}
+```
+
+## Use-Case диаграмма
+```plantuml
+{usecase_code}
+```
+
+## Требования
+{requirements_md}
+"""
+
+
 st.set_page_config(
     page_title="Агент-помощник системного аналитика",
     page_icon="📊",
@@ -48,24 +201,24 @@ if st.button("🚀 Сгенерировать анализ", type="primary", use
     else:
         with st.spinner("🔄 Генерирую анализ..."):
             try:
-                with open("prompts/system_prompt.txt", "r", encoding="utf-8") as f:
-                    system_prompt = f.read()
+                system_prompt = load_system_prompt()
 
                 messages = [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_input}
                 ]
 
-                response = gigachat_client.chat_completion(
+                stream_placeholder = st.empty()
+                assistant_content = stream_chat_completion(
                     messages=messages,
                     model=model_name,
-                    temperature=temperature
+                    temperature=temperature,
+                    placeholder=stream_placeholder
                 )
-
-                assistant_content = response["choices"][0]["message"]["content"]
+                stream_placeholder.empty()
 
                 try:
-                    analysis_result = json.loads(assistant_content)
+                    analysis_result = parse_model_json(assistant_content)
                     st.session_state.analysis_result = analysis_result
                     st.session_state.raw_response = assistant_content
                     st.success("✅ Анализ успешно сгенерирован!")
@@ -132,32 +285,20 @@ if hasattr(st.session_state, 'analysis_result'):
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.button("📥 Скачать Markdown отчет"):
-            # Используем PlantUML код напрямую
-            bpmn_code = st.session_state.analysis_result.get("bpmn_plantuml", "")
-            usecase_code = st.session_state.analysis_result.get("usecase_plantuml", "")
-            
-            report = f"""# Анализ системы: {st.session_state.analysis_result.get('title', 'Неизвестно')}
-
-## BPMN диаграмма процесса
-```plantuml
-{bpmn_code}
-```
-
-## Use-Case диаграмма
-```plantuml
-{usecase_code}
-```
-
-## Требования
-{st.session_state.analysis_result.get('requirements_md', '')}
-"""
-            st.download_button(
-                label="💾 Скачать файл",
-                data=report,
-                file_name=f"analysis_{st.session_state.analysis_result.get('title', 'report').replace(' ', '_')}.md",
-                mime="text/markdown"
-            )
+        analysis_result = st.session_state.analysis_result
+        # Отчет собирается один раз на результат анализа, а не на каждый перезапуск
+        report = build_report(
+            analysis_result.get("title", "Неизвестно"),
+            analysis_result.get("bpmn_plantuml", ""),
+            analysis_result.get("usecase_plantuml", ""),
+            analysis_result.get("requirements_md", "")
+        )
+        st.download_button(
+            label="📥 Скачать Markdown отчет",
+            data=report,
+            file_name=f"analysis_{analysis_result.get('title', 'report').replace(' ', '_')}.md",
+            mime="text/markdown"
+        )
 
     with col2:
         if st.button("🔄 Сгенерировать новый анализ"):
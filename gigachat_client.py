@@ -1,11 +1,44 @@
 import os
-from typing import List, Dict, Any
+import base64
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator
 from dotenv import load_dotenv
-from gigachat import GigaChat
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
+
+@functools.cache
+def _gigachat_class():
+    """Импортирует SDK GigaChat при первом создании клиента, а не при загрузке модуля"""
+    from gigachat import GigaChat
+    return GigaChat
+
+
+# Средняя длина токена в символах для оценки без токенизатора
+_CHARS_PER_TOKEN = 4
+
+
+@functools.cache
+def _token_encoder():
+    """BPE-токенизатор tiktoken, если он установлен; иначе None"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@functools.lru_cache(maxsize=1024)
+def _approx_tokens(text: str) -> int:
+    """Приблизительное число токенов в тексте, без обращения к API"""
+    encoder = _token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
 class GigaChatClient:
     def __init__(self):
         # Получаем credentials из переменных окружения
@@ -13,17 +46,28 @@ class GigaChatClient:
         if not self.credentials:
             raise ValueError("GIGACHAT_AUTH_KEY или GIGACHAT_CLIENT_ID/GIGACHAT_CLIENT_SECRET должны быть установлены в .env файле")
 
-        # Создаем экземпляр официального клиента GigaChat
-        self.client = GigaChat(
+        # Создаем экземпляр официального клиента GigaChat. Он держит собственный пул
+        # HTTP-соединений (httpx) с keep-alive и токен, поэтому экземпляр переиспользуется,
+        # а не создается на каждый запрос
+        self.client = _gigachat_class()(
             credentials=self.credentials,
             scope="GIGACHAT_API_PERS",
             model="GigaChat-Pro",
             verify_ssl_certs=False  # Отключаем верификацию SSL для работы с корпоративными сертификатами
         )
 
+    def close(self):
+        """Закрывает пул соединений SDK"""
+        self.client.close()
+
+    def __enter__(self) -> "GigaChatClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def _get_credentials_from_env(self) -> str:
         """Генерирует credentials из client_id и client_secret"""
-        import base64
         client_id = os.getenv("GIGACHAT_CLIENT_ID")
         client_secret = os.getenv("GIGACHAT_CLIENT_SECRET")
 
@@ -58,6 +102,32 @@ class GigaChatClient:
         except Exception as e:
             raise ValueError(f"Ошибка при запросе к GigaChat API: {str(e)}")
 
+    def chat_completion_stream(self, messages: List[Dict[str, str]], model: str = "GigaChat-Pro", temperature: float = 0.0) -> Iterator[str]:
+        """Отправляет запрос и возвращает текст ответа модели по частям по мере генерации"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature
+        }
+        try:
+            for chunk in self.client.stream(payload):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise ValueError(f"Ошибка при запросе к GigaChat API: {str(e)}")
+
+    def chat_completion_batch(self, batch: List[List[Dict[str, str]]], model: str = "GigaChat-Pro", temperature: float = 0.0) -> List[Dict[str, Any]]:
+        """Отправляет несколько запросов параллельно через общий клиент; ответы в порядке batch"""
+        if not batch:
+            return []
+        # SDK не поддерживает пакетные запросы, поэтому запросы выполняются в потоках,
+        # разделяя одно соединение и токен авторизации
+        with ThreadPoolExecutor(max_workers=len(batch)) as executor:
+            return list(executor.map(
+                lambda messages: self.chat_completion(messages, model=model, temperature=temperature),
+                batch
+            ))
+
     def get_models(self) -> Dict[str, Any]:
         """Получает список доступных моделей"""
         try:
@@ -80,20 +150,41 @@ class GigaChatClient:
         except Exception as e:
             raise ValueError(f"Ошибка при подсчете токенов: {str(e)}")
 
+    def estimate_tokens(self, input_text: List[str]) -> Dict[str, Any]:
+        """
+        Локально оценивает количество токенов в тексте (без сетевого запроса)
+
+        Дает лишь грубую оценку для проверок размера ввода в интерфейсе: cl100k_base из
+        tiktoken (или 4 символа на токен без него) делит текст, особенно кириллицу, иначе,
+        чем токенизатор GigaChat, и расхождение не измерялось. Для точного значения
+        используйте tokens_count
+        """
+        return {
+            "tokens": sum(_approx_tokens(text) for text in input_text)
+        }
+
     def test_connection(self) -> bool:
         """Тестирует подключение к API"""
         try:
             print("🔧 Тестирую подключение к GigaChat API...")
             print(f"🔑 Credentials: {'✅ Установлены' if self.credentials else '❌ Не установлены'}")
 
-            # Пробуем получить список моделей
-            models = self.get_models()
-            print(f"✅ Список моделей получен: {len(models.get('data', []))} моделей")
+            # Токен запрашивается один раз заранее, иначе оба параллельных запроса
+            # получали бы его сами
+            self.client.get_token()
+            print("✅ Токен доступа получен")
 
-            # Пробуем сделать тестовый запрос
+            # Список моделей и тестовый запрос не зависят друг от друга и идут параллельно
             test_messages = [{"role": "user", "content": "Hello"}]
-            response = self.chat_completion(test_messages)
-            print(f"✅ Тестовый запрос выполнен успешно")
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                models_future = executor.submit(self.get_models)
+                response_future = executor.submit(self.chat_completion, test_messages)
+
+                models = models_future.result()
+                print(f"✅ Список моделей получен: {len(models.get('data', []))} моделей")
+
+                response = response_future.result()
+                print(f"✅ Тестовый запрос выполнен успешно")
 
             return True
 
@@ -101,5 +192,3 @@ class GigaChatClient:
             print(f"❌ Ошибка подключения: {str(e)}")
             return False
 
-# Глобальный экземпляр клиента
-gigachat_client = GigaChatClient()
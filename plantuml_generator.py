@@ -6,6 +6,49 @@
 import re
 from typing import Dict, Any, List
 
+import requests
+import streamlit as st
+
+
+# Соединения Mermaid разбираются одним проходом регулярного выражения по всему тексту.
+# Соединение должно начинаться в начале строки: комментарии (%%) и строка с типом
+# диаграммы не совпадают, а из цепочки A --> B --> C берется только первое звено
+# Текст берется из [текст], ([текст]), [[текст]] и {условие}, {{условие}};
+# у прочих форм вроде (текст) и >текст] учитывается только id
+_NODE = r'(\w+)[ \t]*(?:\(?\[+([^\]\n]+)\]+\)?|\{+([^}\n]+)\}+|\([^)\n]*\)+|>[^\]\n]*\])?'
+_LABEL = r'(?:\|([^|\n]+)\|[ \t]*)?'
+# Стрелка любой длины (-->, --->) с необязательным текстом на связи: A -- да --> B
+_ARROW = r'(?:--(?![->])[ \t]*([^\n>]+?)[ \t]*)?--+>'
+_BPMN_EDGE_RE = re.compile(
+    r'^[ \t]*' + _NODE + r'[ \t]*' + _ARROW + r'[ \t]*' + _LABEL + _NODE,
+    re.MULTILINE
+)
+
+_UC_ELEMENT = r'(\w+)(?:\[([^\]\n]+)\]|\(\(([^)\n]+)\)\))?'
+# Сплошная или пунктирная стрелка целиком, текст на связи - отдельной группой
+_UC_ARROW = (
+    r'(--(?![->])[ \t]*([^\n>]+?)[ \t]*--+>'
+    r'|-\.(?![.-])[ \t]*([^\n>]+?)[ \t]*\.+->'
+    r'|--+>|-\.+->)'
+)
+_UC_EDGE_RE = re.compile(
+    r'^[ \t]*' + _UC_ELEMENT + r'[ \t]*' + _UC_ARROW + r'[ \t]*' + _LABEL + _UC_ELEMENT,
+    re.MULTILINE
+)
+
+# Признаки узла-условия: вопрос или слова "как"/"ли" в тексте
+_CONDITION_RE = re.compile(r'\?|как|ли', re.IGNORECASE)
+
+
+def _is_condition(node_text: str) -> bool:
+    """Проверяет, является ли узел BPMN диаграммы условием"""
+    return _CONDITION_RE.search(node_text) is not None
+
+
+def _arrow(label: str) -> str:
+    """Стрелка PlantUML с необязательной меткой"""
+    return f"-->[\"{label}\"]" if label else "-->"
+
 
 def generateBPMNDiagram(processData: Dict[str, Any]) -> str:
     """
@@ -41,65 +84,28 @@ def generateBPMNDiagram(processData: Dict[str, Any]) -> str:
         "}"
     ])
     
-    lines = mermaid_code.strip().split('\n')
-    
-    # Пропускаем первую строку с типом диаграммы Mermaid
-    if lines and lines[0].strip().startswith('flowchart'):
-        lines = lines[1:]
-    
     # Словарь для хранения узлов и их типов
     nodes = {}
     connections = []
     
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('%%'):
-            continue
+    # Методы привязаны к локальным именам до цикла: без поиска атрибута на каждой итерации
+    nodes_setitem = nodes.__setitem__
+    connections_append = connections.append
+    
+    for match in _BPMN_EDGE_RE.finditer(mermaid_code):
+        (source_id, source_box, source_cond, link_text, label,
+         target_id, target_box, target_cond) = match.groups()
+        label = link_text or label
         
-        # Парсим узлы и соединения
-        if '-->' in line:
-            parts = line.split('-->')
-            if len(parts) >= 2:
-                # Извлекаем исходный узел
-                source_part = parts[0].strip()
-                source_match = re.match(r'^(\w+)', source_part)
-                if source_match:
-                    source_id = source_match.group(1)
-                    
-                    # Извлекаем текст узла
-                    source_text_match = re.search(r'\[([^\]]+)\]', source_part)
-                    if source_text_match:
-                        nodes[source_id] = source_text_match.group(1)
-                    else:
-                        # Проверяем на условие
-                        condition_match = re.search(r'\{([^\}]+)\}', source_part)
-                        if condition_match:
-                            nodes[source_id] = condition_match.group(1)
-                
-                # Извлекаем целевой узел
-                target_part = parts[1].strip()
-                
-                # Извлекаем метку соединения
-                label = ""
-                label_match = re.search(r'\|([^|]+)\|', target_part)
-                if label_match:
-                    label = label_match.group(1)
-                    target_part = re.sub(r'\|[^|]+\|', '', target_part).strip()
-                
-                target_match = re.match(r'^(\w+)', target_part)
-                if target_match:
-                    target_id = target_match.group(1)
-                    
-                    # Извлекаем текст целевого узла
-                    target_text_match = re.search(r'\[([^\]]+)\]', target_part)
-                    if target_text_match:
-                        nodes[target_id] = target_text_match.group(1)
-                    else:
-                        condition_match = re.search(r'\{([^\}]+)\}', target_part)
-                        if condition_match:
-                            nodes[target_id] = condition_match.group(1)
-                    
-                    connections.append((source_id, target_id, label))
+        # Текст узла берется из [текст] или из {условие}
+        source_text = source_box or source_cond
+        if source_text:
+            nodes_setitem(source_id, source_text)
+        target_text = target_box or target_cond
+        if target_text:
+            nodes_setitem(target_id, target_text)
+        
+        connections_append((source_id, target_id, label or ""))
     
     # Генерируем PlantUML активити диаграмму
     plantuml_lines.append("|")
@@ -109,28 +115,39 @@ def generateBPMNDiagram(processData: Dict[str, Any]) -> str:
         start_node = list(nodes.keys())[0]
         plantuml_lines.append(f"(*) --> \"{nodes[start_node]}\"")
         
-        # Генерируем соединения
-        for source, target, label in connections:
-            if source in nodes and target in nodes:
-                # Определяем тип узла
-                source_text = nodes[source]
-                target_text = nodes[target]
-                
-                # Проверяем, является ли узел условием
-                if '?' in source_text or 'как' in source_text.lower() or 'ли' in source_text.lower():
-                    # Условный узел
-                    if label:
-                        plantuml_lines.append(f"if \"{source_text}\" then")
-                        plantuml_lines.append(f"  -->[\"{label}\"] \"{target_text}\"")
-                    else:
-                        plantuml_lines.append(f"if \"{source_text}\" then")
-                        plantuml_lines.append(f"  --> \"{target_text}\"")
-                else:
-                    # Обычное действие
-                    if label:
-                        plantuml_lines.append(f"-->[\"{label}\"] \"{target_text}\"")
-                    else:
-                        plantuml_lines.append(f"--> \"{target_text}\"")
+        # Соединения, у которых оба узла известны
+        edges = [
+            (source, f"{_arrow(label)} \"{nodes[target]}\"")
+            for source, target, label in connections
+            if source in nodes and target in nodes
+        ]
+        
+        # Все ветви условного узла собираются под одним if ... else ... endif
+        branches = {}
+        for source, edge in edges:
+            if _is_condition(nodes[source]):
+                branches.setdefault(source, []).append(edge)
+        
+        emitted_ifs = set()
+        for source, edge in edges:
+            if source not in branches:
+                # Обычное действие
+                plantuml_lines.append(edge)
+            elif source not in emitted_ifs:
+                # Условный узел выводится один раз вместе со всеми ветвями
+                emitted_ifs.add(source)
+                plantuml_lines.append(f"if \"{nodes[source]}\" then")
+                source_branches = branches[source]
+                last = len(source_branches) - 1
+                for index, branch in enumerate(source_branches):
+                    if index:
+                        plantuml_lines.append("else")
+                        # Каждая средняя ветвь - своя вложенная развилка, иначе следующие
+                        # ветви рисовались бы продолжением этой, а не выходом из условия
+                        if index < last:
+                            plantuml_lines.append("if \"\" then")
+                    plantuml_lines.append(f"  {branch}")
+                plantuml_lines.extend(["endif"] * max(last, 1))
     
     # Добавляем конечную точку
     plantuml_lines.append("--> (*)")
@@ -170,118 +187,158 @@ def generateUseCaseDiagram(actorData: Dict[str, Any]) -> str:
         "}"
     ])
     
-    lines = mermaid_code.strip().split('\n')
-    
-    # Пропускаем первую строку с типом диаграммы Mermaid
-    if lines and lines[0].strip().startswith('flowchart'):
-        lines = lines[1:]
-    
     # Словарь для хранения акторов и use-case
     actors = {}
     usecases = {}
     connections = []
     
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('%%'):
-            continue
-        
-        # Парсим связи между акторами и use-case
-        if '-->' in line or '-.->' in line:
-            # Определяем тип соединения
-            if '-->' in line:
-                parts = line.split('-->')
-                connection_type = "-->"
-            else:
-                parts = line.split('-.->')
-                connection_type = ".->"
-            
-            if len(parts) >= 2:
-                # Извлекаем исходный элемент
-                source_part = parts[0].strip()
-                
-                # Проверяем на актора (прямоугольник)
-                if '[' in source_part and not '(' in source_part:
-                    source_match = re.match(r'^(\w+)\[([^\]]+)\]', source_part)
-                    if source_match:
-                        source_id = source_match.group(1)
-                        source_text = source_match.group(2)
-                        actors[source_id] = source_text
-                
-                # Проверяем на use-case (овал)
-                elif '((' in source_part:
-                    source_match = re.match(r'^(\w+)\(\(([^)]+)\)\)', source_part)
-                    if source_match:
-                        source_id = source_match.group(1)
-                        source_text = source_match.group(2)
-                        usecases[source_id] = source_text
-                
-                # Извлекаем целевой элемент
-                target_part = parts[1].strip()
-                
-                # Извлекаем метку соединения
-                label = ""
-                label_match = re.search(r'\|([^|]+)\|', target_part)
-                if label_match:
-                    label = label_match.group(1)
-                    target_part = re.sub(r'\|[^|]+\|', '', target_part).strip()
-                
-                # Проверяем на актора
-                if '[' in target_part and not '(' in target_part:
-                    target_match = re.match(r'^(\w+)\[([^\]]+)\]', target_part)
-                    if target_match:
-                        target_id = target_match.group(1)
-                        target_text = target_match.group(2)
-                        actors[target_id] = target_text
-                        connections.append((source_id, target_id, connection_type, label))
-                
-                # Проверяем на use-case
-                elif '((' in target_part:
-                    target_match = re.match(r'^(\w+)\(\(([^)]+)\)\)', target_part)
-                    if target_match:
-                        target_id = target_match.group(1)
-                        target_text = target_match.group(2)
-                        usecases[target_id] = target_text
-                        connections.append((source_id, target_id, connection_type, label))
+    actors_setitem = actors.__setitem__
+    usecases_setitem = usecases.__setitem__
+    connections_append = connections.append
     
-    # Генерируем акторов
-    for actor_id, actor_text in actors.items():
-        plantuml_lines.append(f'actor "{actor_text}" as {actor_id}')
+    for match in _UC_EDGE_RE.finditer(mermaid_code):
+        (source_id, source_actor, source_uc, arrow, solid_text, dotted_text, label,
+         target_id, target_actor, target_uc) = match.groups()
+        connection_type = ".->" if arrow.startswith("-.") else "-->"
+        label = solid_text or dotted_text or label
+        
+        # Актор задается прямоугольником [текст], use-case - овалом ((текст))
+        if source_actor:
+            actors_setitem(source_id, source_actor)
+        elif source_uc:
+            usecases_setitem(source_id, source_uc)
+        
+        # Связь добавляется, только если у цели указана форма
+        if target_actor:
+            actors_setitem(target_id, target_actor)
+        elif target_uc:
+            usecases_setitem(target_id, target_uc)
+        else:
+            continue
+        connections_append((source_id, target_id, connection_type, label or ""))
     
+    # Генерируем акторов, use-case и связи пакетно
+    plantuml_lines.extend([f'actor "{actor_text}" as {actor_id}' for actor_id, actor_text in actors.items()])
     plantuml_lines.append("")
-    
-    # Генерируем use-case
-    for uc_id, uc_text in usecases.items():
-        plantuml_lines.append(f'usecase "{uc_text}" as {uc_id}')
-    
+    plantuml_lines.extend([f'usecase "{uc_text}" as {uc_id}' for uc_id, uc_text in usecases.items()])
     plantuml_lines.append("")
-    
-    # Генерируем связи
-    for source, target, conn_type, label in connections:
-        if label:
-            if conn_type == ".->":
-                plantuml_lines.append(f'{source} .{conn_type[1:]} "{label}" {target}')
-            else:
-                plantuml_lines.append(f'{source} {conn_type} "{label}" {target}')
-        else:
-            plantuml_lines.append(f'{source} {conn_type} {target}')
+    plantuml_lines.extend([
+        f'{source} {conn_type} "{label}" {target}' if label else f'{source} {conn_type} {target}'
+        for source, target, conn_type, label in connections
+    ])
     
     plantuml_lines.append("@enduml")
     
     return '\n'.join(plantuml_lines)
 
 
-# Импортируем новый рендерер и фиксатор синтаксиса
-try:
-    from plantuml_renderer import render_plantuml as render_plantuml_local
-except ImportError:
-    render_plantuml_local = None
+# Импортируем новый рендерер и фиксатор синтаксиса; кодирование для URL сервера
+# PlantUML общее с рендерером, поэтому он обязателен
+from plantuml_renderer import encode_plantuml_compressed, render_plantuml as render_plantuml_local
 
 try:
     from plantuml_syntax_fixer import auto_fix_plantuml
 except ImportError:
     auto_fix_plantuml = None
 
+# Онлайн-серверы PlantUML в порядке предпочтения
+PLANTUML_SERVERS = [
+    "https://www.plantuml.com/plantuml/png/",
+    "https://plantuml-server.kkeisuke.com/plantuml/png/",
+    "https://plantuml.aoaostudio.com/png/",
+]
+
+
+@st.cache_resource(ttl=300, show_spinner=False)
+def _best_plantuml_server() -> str:
+    """Первый исправный сервер PlantUML; проверка повторяется не чаще раза в 5 минут"""
+    for server in PLANTUML_SERVERS:
+        try:
+            response = requests.head(server, timeout=1, allow_redirects=True)
+        except requests.RequestException:
+            continue
+        # 5xx (в том числе страницы обслуживания) - сервер неисправен, пробуем следующий
+        if response.status_code < 500:
+            return server
+    return PLANTUML_SERVERS[0]
+
+
+@st.cache_data(max_entries=128, ttl=3600, show_spinner=False)
+def _plantuml_png(plantuml_code: str) -> bytes:
+    """
+    Загружает PNG диаграммы с сервера PlantUML; последние 128 результатов кэшируются
+    по коду диаграммы на час
+    
+    Raises:
+        requests.RequestException: Если сервер недоступен
+        ValueError: Если сервер вернул не изображение
+    """
+    response = requests.get(_best_plantuml_server() + encode_plantuml_compressed(plantuml_code, wrap=False), timeout=10)
+    # Сервер PlantUML отдает изображение с текстом ошибки и для некорректного кода
+    if not response.headers.get('Content-Type', '').startswith('image/'):
+        response.raise_for_status()
+        raise ValueError(f"Сервер PlantUML вернул {response.headers.get('Content-Type')} вместо изображения")
+    return response.content
+
+
+def _apply_syntax_fixes(plantuml_code: str) -> str:
+    """Применяет автоматические исправления синтаксиса и сообщает о них пользователю"""
+    try:
+        fixed_code, fixes_applied = auto_fix_plantuml(plantuml_code)
+        if fixes_applied:
+            st.info(f"🔧 Применены автоматические исправления синтаксиса PlantUML:")
+            for fix in fixes_applied:
+                st.text(f"  • {fix}")
+            return fixed_code
+    except Exception as e:
+        st.warning(f"⚠️ Ошибка при автоматическом исправлении синтаксиса: {e}")
+        st.info("Будет использован исходный код")
+    return plantuml_code
+
+
+def _skip_syntax_fixes(plantuml_code: str) -> str:
+    """Фиксатор синтаксиса недоступен: код используется как есть"""
+    return plantuml_code
+
+
+def _render_local(plantuml_code: str, height: int):
+    """Рендерит локальным рендерером, при ошибке переходит к онлайн-рендерингу"""
+    try:
+        render_plantuml_local(plantuml_code, height)
+    except Exception as e:
+        st.warning(f"⚠️ Локальный рендерер не сработал: {e}")
+        st.info("Будет использован онлайн-рендерер как запасной вариант")
+        _render_remote(plantuml_code, height)
+
+
+def _render_remote(plantuml_code: str, height: int):
+    """Рендерит диаграмму через онлайн-серверы PlantUML"""
+    # Онлайн рендеринг, PNG загружается один раз на диаграмму
+    try:
+        st.image(_plantuml_png(plantuml_code))
+        return
+    except (requests.RequestException, ValueError) as e:
+        st.warning(f"⚠️ Не удалось загрузить диаграмму с сервера PlantUML: {e}")
+    
+    # Последний вариант: браузер сам загружает изображение с выбранного сервера
+    # Кодируем PlantUML код для URL (deflate короче процентного кодирования в разы)
+    image_url = _best_plantuml_server() + encode_plantuml_compressed(plantuml_code, wrap=False)
+    st.image(image_url)
+    with st.expander("Диаграмма не отображается?"):
+        st.markdown(
+            "Возможные причины:\n"
+            "- Проблемы с подключением к серверу PlantUML\n"
+            "- Некорректный синтаксис PlantUML кода\n"
+            "- Слишком большая диаграмма для онлайн-рендеринга"
+        )
+        st.code(plantuml_code, language="text")
+
+
+# Доступность фиксатора известна при импорте, поэтому выбираем реализацию один раз
+_prepare_code = _apply_syntax_fixes if auto_fix_plantuml is not None else _skip_syntax_fixes
+_render = _render_local
+
+
 def render_plantuml(plantuml_code: str, height: int = 500):
     """
     Рендерит PlantUML диаграмму с использованием локального или онлайн рендеринга
@@ -291,161 +348,7 @@ def render_plantuml(plantuml_code: str, height: int = 500):
         plantuml_code: PlantUML код для рендеринга
         height: Высота контейнера для диаграммы
     """
-    import streamlit as st
-    
     if not plantuml_code:
         return
     
-    # Автоматически исправляем синтаксис, если доступен фиксатор
-    if auto_fix_plantuml is not None:
-        try:
-            fixed_code, fixes_applied = auto_fix_plantuml(plantuml_code)
-            if fixes_applied:
-                st.info(f"🔧 Применены автоматические исправления синтаксиса PlantUML:")
-                for fix in fixes_applied:
-                    st.text(f"  • {fix}")
-                plantuml_code = fixed_code
-        except Exception as e:
-            st.warning(f"⚠️ Ошибка при автоматическом исправлении синтаксиса: {e}")
-            st.info("Будет использован исходный код")
-    
-    # Пробуем локальный рендерер, если доступен
-    if render_plantuml_local is not None:
-        try:
-            render_plantuml_local(plantuml_code, height)
-            return
-        except Exception as e:
-            st.warning(f"⚠️ Локальный рендерер не сработал: {e}")
-            st.info("Будет использован онлайн-рендерер как запасной вариант")
-    
-    # Запасной вариант: используем старый онлайн рендеринг
-    import streamlit.components.v1 as components
-    import urllib.parse
-    import base64
-    import hashlib
-    
-    # Кодируем PlantUML код для URL
-    encoded_code = urllib.parse.quote(plantuml_code)
-    
-    # Используем несколько альтернативных серверов PlantUML
-    servers = [
-        f"https://www.plantuml.com/plantuml/png/{encoded_code}",
-        f"https://plantuml-server.kkeisuke.com/plantuml/png/{encoded_code}",
-        f"https://plantuml.aoaostudio.com/png/{encoded_code}"
-    ]
-    
-    # Генерируем уникальный ID для диаграммы
-    diagram_id = hashlib.md5(plantuml_code.encode()).hexdigest()[:8]
-    
-    html_code = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                margin: 0;
-                padding: 20px;
-                display: flex;
-                justify-content: center;
-                align-items: flex-start;
-                min-height: 100vh;
-                background-color: #ffffff;
-            }}
-            .plantuml-container {{
-                width: 100%;
-                max-width: 100%;
-                text-align: center;
-            }}
-            .plantuml-container img {{
-                max-width: 100%;
-                height: auto;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }}
-            .error-message {{
-                color: #d32f2f;
-                background-color: #ffebee;
-                padding: 16px;
-                border-radius: 4px;
-                border-left: 4px solid #d32f2f;
-                font-family: monospace;
-                white-space: pre-wrap;
-                word-wrap: break-word;
-            }}
-            .code-display {{
-                background-color: #f5f5f5;
-                padding: 16px;
-                border-radius: 4px;
-                font-family: monospace;
-                white-space: pre-wrap;
-                text-align: left;
-                margin: 10px 0;
-            }}
-            .loading {{
-                color: #666;
-                font-style: italic;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="plantuml-container">
-            <div class="code-display">
-                <strong>PlantUML Code:</strong><br>
-                {plantuml_code.replace('<', '<').replace('>', '>')}
-            </div>
-            <div id="loading-{diagram_id}" class="loading">
-                Загрузка диаграммы...
-            </div>
-            <img id="diagram-{diagram_id}" style="display:none;" alt="PlantUML Diagram" onerror="this.style.display='none'; document.getElementById('error-{diagram_id}').style.display='block'; document.getElementById('loading-{diagram_id}').style.display='none';">
-            <div id="error-{diagram_id}" class="error-message" style="display:none;">
-                <strong>Ошибка загрузки диаграммы PlantUML</strong><br><br>
-                Возможные причины:<br>
-                • Проблемы с подключением к серверу PlantUML<br>
-                • Некорректный синтаксис PlantUML кода<br>
-                • Слишком большая диаграмма для онлайн-рендеринга<br><br>
-                <strong>PlantUML код:</strong><br>
-                {plantuml_code.replace('<', '<').replace('>', '>')}
-            </div>
-        </div>
-        <script>
-            // Пробуем разные серверы
-            const servers = {servers};
-            const diagramId = '{diagram_id}';
-            let currentServer = 0;
-            
-            function loadDiagram() {{
-                if (currentServer >= servers.length) {{
-                    document.getElementById('loading-' + diagramId).style.display = 'none';
-                    document.getElementById('error-' + diagramId).style.display = 'block';
-                    return;
-                }}
-                
-                const img = document.getElementById('diagram-' + diagramId);
-                const loading = document.getElementById('loading-' + diagramId);
-                
-                img.onload = function() {{
-                    loading.style.display = 'none';
-                    img.style.display = 'block';
-                }};
-                
-                img.onerror = function() {{
-                    currentServer++;
-                    loadDiagram();
-                }};
-                
-                img.src = servers[currentServer];
-            }}
-            
-            // Начинаем загрузку
-            loadDiagram();
-        </script>
-    </body>
-    </html>
-    """
-    
-    try:
-        components.html(html_code, height=height, scrolling=True)
-    except Exception as e:
-        st.error(f"❌ Ошибка отображения PlantUML диаграммы: {e}")
-        st.code(plantuml_code, language="text")
+    _render(_prepare_code(plantuml_code), height)
@@ -4,14 +4,196 @@
 Требует наличия Java Runtime Environment (JRE)
 """
 
+import asyncio
+import concurrent.futures
 import os
+import queue
 import subprocess
 import tempfile
-import base64
+import functools
 import hashlib
+import html
+import json
+import secrets
+import shutil
 import zlib
-from typing import Optional
-import streamlit as st
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Необязательный pybase64 ускоряет b64encode для длинных диаграмм
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+
+# Каталог дискового кэша готовых изображений (ключ - хэш содержимого)
+_CACHE_DIR = Path(tempfile.gettempdir()) / "plantuml_cache"
+
+# Разделитель, который PlantUML печатает после каждой диаграммы в режиме -pipe.
+# Случайный на процесс: текст меток попадает в SVG как есть, и угаданный разделитель
+# в коде диаграммы разрезал бы вывод посередине
+PIPE_DELIMITER = f"___PLANTUML_DIAGRAM_END_{secrets.token_hex(16)}___"
+
+# Версия формата ключей дискового кэша; смена отбрасывает все прежние записи
+_CACHE_KEY_VERSION = b"2"
+
+# Настройки JVM для коротких процессов: только C1, последовательный GC и общий архив классов
+_ONE_SHOT_JVM_FLAGS = (
+    "-XX:TieredStopAtLevel=1",
+    "-XX:+UseSerialGC",
+    "-Xshare:auto",
+    "-Xms32m",
+)
+
+# Не больше стольких процессов PlantUML на формат: каждый держит свою JVM в памяти
+_PIPE_POOL_SIZE = min(4, os.cpu_count() or 1)
+
+
+class PlantUMLPipe:
+    """Долгоживущий процесс PlantUML в режиме -pipe: одна JVM на все диаграммы одного формата"""
+    
+    def __init__(self, java_path: str, jar_path: str, output_format: str = "png", timeout: int = 30):
+        """
+        Запускает процесс PlantUML
+        
+        Args:
+            java_path: Путь к исполняемому файлу Java
+            jar_path: Путь к файлу plantuml.jar
+            output_format: Формат вывода (png, svg, etc.)
+            timeout: Максимальное время рендеринга одной диаграммы в секундах
+        """
+        self.timeout = timeout
+        self._delimiter = PIPE_DELIMITER.encode('ascii')
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            [
+                java_path,
+                "-Djava.awt.headless=true",
+                "-jar", jar_path,
+                "-charset", "UTF-8",
+                f"-t{output_format}",
+                "-pipe",
+                "-pipedelimitor", PIPE_DELIMITER
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    
+    def is_alive(self) -> bool:
+        """Проверяет, что процесс PlantUML еще работает"""
+        return self._process.poll() is None
+    
+    def render(self, plantuml_code: str) -> bytes:
+        """
+        Рендерит одну диаграмму (@startuml ... @enduml) через запущенный процесс
+        
+        Returns:
+            Байты изображения
+        """
+        with self._lock:
+            try:
+                self._process.stdin.write(plantuml_code.encode('utf-8') + b"\n")
+                self._process.stdin.flush()
+            except OSError as e:
+                raise RuntimeError(f"PlantUML pipe process is not available: {e}")
+            return self._read_frame()
+    
+    def close(self):
+        """Завершает процесс PlantUML"""
+        with self._lock:
+            if self._process.stdin:
+                try:
+                    self._process.stdin.close()
+                except OSError:
+                    pass
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+    
+    def _read_frame(self) -> bytes:
+        """Читает stdout до разделителя; по таймауту процесс завершается"""
+        timer = threading.Timer(self.timeout, self._process.kill)
+        timer.start()
+        try:
+            # Буфер растет на месте; разделитель ищется только в новых данных
+            search_from = 0
+            while True:
+                index = self._buffer.find(self._delimiter, search_from)
+                if index != -1:
+                    frame = bytes(self._buffer[:index])
+                    del self._buffer[:index + len(self._delimiter)]
+                    # Перевод строки после предыдущего разделителя попадает в начало кадра
+                    return frame.lstrip(b"\r\n")
+                search_from = max(0, len(self._buffer) - len(self._delimiter) + 1)
+                chunk = self._process.stdout.read1(65536)
+                if not chunk:
+                    if timer.finished.is_set():
+                        raise TimeoutError(f"PlantUML rendering timeout ({self.timeout} seconds)")
+                    raise RuntimeError("PlantUML pipe process terminated")
+                self._buffer += chunk
+        finally:
+            timer.cancel()
+
+
+@functools.lru_cache(maxsize=1)
+def _find_java() -> Optional[str]:
+    """Поиск Java в PATH и JAVA_HOME без запуска JVM (один раз на процесс)"""
+    java_path = shutil.which("java") or shutil.which("java.exe")
+    if java_path:
+        return java_path
+    
+    # Проверяем JAVA_HOME если установлено
+    java_home = os.environ.get("JAVA_HOME")
+    if java_home:
+        for name in ("java", "java.exe"):
+            path = os.path.join(java_home, "bin", name)
+            if os.path.isfile(path):
+                return path
+    
+    return None
+
+
+@functools.lru_cache(maxsize=8)
+def _java_runs(java_path: str) -> bool:
+    """Проверяет, что Java действительно запускается ("java -version"); результат запоминается"""
+    try:
+        result = subprocess.run(
+            [java_path, "-version"], 
+            capture_output=True, 
+            timeout=5,
+            check=False
+        )
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, OSError):
+        return False
+
+
+@functools.lru_cache(maxsize=1)
+def _find_plantuml_jar() -> Optional[str]:
+    """Поиск plantuml.jar в системе (один раз на процесс)"""
+    possible_locations = [
+        "plantuml.jar",
+        os.path.join("lib", "plantuml.jar"),
+        os.path.join("deps", "plantuml.jar"),
+        os.path.join(os.path.dirname(__file__), "plantuml.jar"),
+        os.path.join(os.path.dirname(__file__), "lib", "plantuml.jar"),
+        os.path.join(os.path.dirname(__file__), "deps", "plantuml.jar")
+    ]
+    
+    for location in possible_locations:
+        if os.path.exists(location):
+            return os.path.abspath(location)
+    
+    return None
 
 
 class PlantUMLRenderer:
@@ -32,57 +214,206 @@ class PlantUMLRenderer:
         
         if not self.java_path:
             raise RuntimeError("Java Runtime Environment (JRE) не найден. Пожалуйста, установите Java.")
+        
+        # Пулы процессов PlantUML по формату вывода: в очереди свободные процессы,
+        # None - свободное место, процесс для которого еще не запущен
+        self._pipe_pools: Dict[str, queue.Queue] = {}
+        # Все запущенные процессы, включая занятые рендерингом
+        self._pipes: List[PlantUMLPipe] = []
+        self._pipes_lock = threading.Lock()
+        
+        # Флаги JVM для разовых запусков: быстрый старт важнее JIT-оптимизаций
+        self._java_fast_flags = list(_ONE_SHOT_JVM_FLAGS)
+        
+        # Недавние изображения в памяти: повтор той же диаграммы не трогает диск и JVM
+        self._render_cached = functools.lru_cache(maxsize=256)(self._render_uncached)
     
     def _find_java(self) -> Optional[str]:
         """Поиск Java в системе"""
-        possible_paths = [
-            "java",
-            "java.exe",
-        ]
+        return _find_java()
+    
+    def _find_plantuml_jar(self) -> Optional[str]:
+        """Поиск plantuml.jar в системе"""
+        return _find_plantuml_jar()
+    
+    def render_to_image(self, plantuml_code: str, output_format: str = "png") -> bytes:
+        """
+        Рендерит PlantUML код в изображение
         
-        # Добавляем пути из JAVA_HOME если установлено
-        if "JAVA_HOME" in os.environ:
-            java_home = os.environ["JAVA_HOME"]
-            possible_paths.extend([
-                os.path.join(java_home, "bin", "java.exe"),
-                os.path.join(java_home, "bin", "java")
-            ])
+        Args:
+            plantuml_code: Код PlantUML для рендеринга
+            output_format: Формат вывода (png, svg, etc.)
+            
+        Returns:
+            Байты изображения
+        """
+        if not plantuml_code.strip():
+            raise ValueError("PlantUML код не может быть пустым")
         
-        for path in possible_paths:
-            try:
-                result = subprocess.run(
-                    [path, "-version"], 
-                    capture_output=True, 
-                    timeout=5,
-                    check=False
-                )
-                if result.returncode == 0:
-                    return path
-            except (subprocess.TimeoutExpired, FileNotFoundError):
-                continue
+        return self._render_cached(plantuml_code, output_format)
+    
+    def render_many(self, plantuml_codes: List[str], output_format: str = "png",
+                    parallel: bool = False) -> List[bytes]:
+        """
+        Рендерит несколько диаграмм пулом процессов PlantUML
         
-        return None
+        Args:
+            plantuml_codes: Список кодов PlantUML
+            output_format: Формат вывода (png, svg, etc.)
+            parallel: Рендерить отдельными процессами Java на всех ядрах
+                (выгодно для большого числа новых диаграмм)
+            
+        Returns:
+            Байты изображений в том же порядке
+        """
+        # Повторы внутри пакета рендерятся один раз
+        unique_codes = dict.fromkeys(plantuml_codes)
+        if parallel and len(unique_codes) > 1:
+            images = asyncio.run(self.render_many_async(list(unique_codes), output_format))
+            unique_codes.update(zip(unique_codes, images))
+        elif len(unique_codes) > 1:
+            with concurrent.futures.ThreadPoolExecutor(_PIPE_POOL_SIZE) as executor:
+                images = list(executor.map(
+                    lambda code: self.render_to_image(code, output_format), unique_codes
+                ))
+            unique_codes.update(zip(unique_codes, images))
+        else:
+            for code in unique_codes:
+                unique_codes[code] = self.render_to_image(code, output_format)
+        return [unique_codes[code] for code in plantuml_codes]
     
-    def _find_plantuml_jar(self) -> Optional[str]:
-        """Поиск plantuml.jar в системе"""
-        possible_locations = [
-            "plantuml.jar",
-            os.path.join("lib", "plantuml.jar"),
-            os.path.join("deps", "plantuml.jar"),
-            os.path.join(os.path.dirname(__file__), "plantuml.jar"),
-            os.path.join(os.path.dirname(__file__), "lib", "plantuml.jar"),
-            os.path.join(os.path.dirname(__file__), "deps", "plantuml.jar")
-        ]
+    def _render_uncached(self, plantuml_code: str, output_format: str) -> bytes:
+        """Рендеринг с дисковым кэшем, без кэша в памяти"""
+        # Повторный рендеринг той же диаграммы - одно чтение файла
+        cache_file = self._cache_file(plantuml_code, output_format)
+        try:
+            return _read_file(cache_file)
+        except OSError:
+            pass
         
-        for location in possible_locations:
-            if os.path.exists(location):
-                return os.path.abspath(location)
+        image_data = self._render(plantuml_code, output_format)
+        self._store_cache(cache_file, image_data)
+        return image_data
+    
+    def _cache_file(self, plantuml_code: str, output_format: str) -> Path:
+        """Путь к файлу кэша: ключ зависит от кода, формата и версии plantuml.jar"""
+        key = hashlib.sha256(
+            _CACHE_KEY_VERSION
+            + plantuml_code.encode('utf-8')
+            + output_format.encode('utf-8')
+            + str(os.path.getmtime(self.jar_path)).encode('ascii')
+        ).hexdigest()
+        # Файлы раскладываются по подкаталогам из первых двух символов ключа
+        return _CACHE_DIR / key[:2] / f"{key}.{output_format}"
+    
+    def _store_cache(self, cache_file: Path, image_data: bytes):
+        """Атомарно сохраняет изображение в кэш; ошибки записи не мешают рендерингу"""
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(image_data)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            # Полный диск или блокировка антивирусом не должны копить *.tmp в кэше
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+    
+    def clear_cache(self, disk: bool = False):
+        """
+        Очищает кэш изображений
         
-        return None
+        Args:
+            disk: Удалить также файлы дискового кэша
+        """
+        self._render_cached.cache_clear()
+        # Готовые страницы render_plantuml построены из этих изображений
+        _build_local_html.cache_clear()
+        _build_online_html.cache_clear()
+        if disk:
+            shutil.rmtree(_CACHE_DIR, ignore_errors=True)
     
-    def render_to_image(self, plantuml_code: str, output_format: str = "png") -> bytes:
+    def _render(self, plantuml_code: str, output_format: str) -> bytes:
+        """Рендерит код через процесс PlantUML"""
+        # Одиночная диаграмма рендерится через долгоживущий процесс без запуска новой JVM
+        code = _wrap_diagram(plantuml_code)
+        # Код с разделителем (пусть и случайным) в pipe не отправляется
+        if code.count('@enduml') == 1 and PIPE_DELIMITER not in code:
+            # Ждем свободный процесс из пула; параллельные рендеринги идут в разных JVM
+            pool = self._pipe_pool(output_format)
+            # Упавший процесс перезапускается один раз; зависший - нет, ждать второй раз незачем
+            for _ in range(2):
+                pipe = pool.get()
+                rendered = False
+                try:
+                    if pipe is not None and not pipe.is_alive():
+                        self._drop_pipe(pipe)
+                        pipe = None
+                    if pipe is None:
+                        pipe = self._start_pipe(output_format)
+                    image_data = pipe.render(code)
+                    rendered = True
+                    return image_data
+                except TimeoutError as e:
+                    raise RuntimeError(str(e))
+                except (RuntimeError, OSError, ValueError):
+                    # ValueError - запись в stdin, уже закрытый shutdown()
+                    pass
+                finally:
+                    # Место возвращается в пул при любом исходе, иначе пул со временем
+                    # опустеет и pool.get() повиснет навсегда
+                    if rendered:
+                        pool.put(pipe)
+                    else:
+                        pool.put(None)
+                        self._drop_pipe(pipe)
+        
+        return self._render_once(plantuml_code, output_format)
+    
+    def _pipe_pool(self, output_format: str) -> queue.Queue:
+        """Возвращает пул процессов PlantUML для формата; процессы запускаются по мере надобности"""
+        with self._pipes_lock:
+            pool = self._pipe_pools.get(output_format)
+            if pool is None:
+                pool = queue.Queue()
+                for _ in range(_PIPE_POOL_SIZE):
+                    pool.put(None)
+                self._pipe_pools[output_format] = pool
+            return pool
+    
+    def _start_pipe(self, output_format: str) -> PlantUMLPipe:
+        """Запускает новый процесс PlantUML для формата"""
+        pipe = PlantUMLPipe(self.java_path, self.jar_path, output_format)
+        with self._pipes_lock:
+            self._pipes.append(pipe)
+        return pipe
+    
+    def _drop_pipe(self, pipe: Optional[PlantUMLPipe]):
+        """Завершает сломанный процесс; его место в пуле займет новый"""
+        if pipe is None:
+            return
+        with self._pipes_lock:
+            if pipe in self._pipes:
+                self._pipes.remove(pipe)
+        pipe.close()
+    
+    def shutdown(self):
+        """Завершает все запущенные процессы PlantUML; следующий рендеринг запустит их заново"""
+        with self._pipes_lock:
+            pipes = self._pipes
+            self._pipes = []
+            self._pipe_pools.clear()
+        for pipe in pipes:
+            pipe.close()
+    
+    async def render_to_image_async(self, plantuml_code: str, output_format: str = "png") -> bytes:
         """
-        Рендерит PlantUML код в изображение
+        Асинхронно рендерит PlantUML код отдельным процессом Java (с дисковым кэшем)
         
         Args:
             plantuml_code: Код PlantUML для рендеринга
@@ -94,15 +425,58 @@ class PlantUMLRenderer:
         if not plantuml_code.strip():
             raise ValueError("PlantUML код не может быть пустым")
         
-        # Формируем команду для запуска PlantUML
-        cmd = [
+        cache_file = self._cache_file(plantuml_code, output_format)
+        try:
+            return _read_file(cache_file)
+        except OSError:
+            pass
+        
+        process = await asyncio.create_subprocess_exec(
+            *self._once_command(output_format),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(plantuml_code.encode('utf-8')), timeout=30
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise RuntimeError("PlantUML rendering timeout (30 seconds)")
+        
+        if process.returncode != 0:
+            raise RuntimeError(f"PlantUML rendering failed:\nSTDERR: {stderr.decode('utf-8', errors='replace')}")
+        
+        self._store_cache(cache_file, stdout)
+        return stdout
+    
+    async def render_many_async(self, plantuml_codes: List[str], output_format: str = "png") -> List[bytes]:
+        """Рендерит несколько диаграмм параллельными процессами Java, не больше одного на ядро"""
+        semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+        
+        async def render_one(code: str) -> bytes:
+            async with semaphore:
+                return await self.render_to_image_async(code, output_format)
+        
+        return await asyncio.gather(*(render_one(code) for code in plantuml_codes))
+    
+    def _once_command(self, output_format: str) -> List[str]:
+        """Команда запуска PlantUML для одной передачи кода через stdin"""
+        return [
             self.java_path,
             "-Djava.awt.headless=true",
+            *self._java_fast_flags,
             "-jar", self.jar_path,
             "-charset", "UTF-8",
             f"-t{output_format}",
             "-pipe"
         ]
+    
+    def _render_once(self, plantuml_code: str, output_format: str) -> bytes:
+        """Рендерит код отдельным запуском JVM"""
+        cmd = self._once_command(output_format)
         
         try:
             # Запускаем процесс с передачей кода через stdin
@@ -126,13 +500,31 @@ class PlantUMLRenderer:
             raise RuntimeError(f"PlantUML rendering error: {str(e)}")
 
 
+def _read_file(path: Path) -> bytes:
+    """Читает файл целиком одним os.read, без буферизованной обертки Python"""
+    # O_BINARY обязателен на Windows: иначе CRT переводит \r\n и обрывает чтение на \x1a
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        return os.read(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+
+def _wrap_diagram(plantuml_code: str) -> str:
+    """Добавляет @startuml/@enduml, если их нет: без @enduml режим -pipe ждет продолжения"""
+    plantuml_code = plantuml_code.strip()
+    if not plantuml_code.startswith('@start'):
+        plantuml_code = '@startuml\n' + plantuml_code
+    if not plantuml_code.endswith('@enduml'):
+        plantuml_code = plantuml_code + '\n@enduml'
+    return plantuml_code
+
+
 def encode_plantuml_text(plantuml_code: str) -> str:
     """
     Кодирует PlantUML код для использования в текстовом формате URL
     Использует простое URL-кодирование для текстового формата
     """
-    import urllib.parse
-    
     # Убираем начальные/конечные пробелы
     plantuml_code = plantuml_code.strip()
     
@@ -146,66 +538,265 @@ def encode_plantuml_text(plantuml_code: str) -> str:
     return urllib.parse.quote(plantuml_code)
 
 
-def encode_plantuml_compressed(plantuml_code: str) -> str:
+# Перевод стандартного алфавита base64 в алфавит PlantUML (0-9A-Za-z-_)
+_B64_TO_PLANTUML = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+    b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+)
+
+
+def encode_plantuml_compressed(plantuml_code: str, wrap: bool = True) -> str:
     """
     Кодирует PlantUML код в сжатом формате для использования в URL
-    Использует специальный формат кодирования PlantUML сервера
-    """
-    import string
-    
-    # Убираем начальные/конечные пробелы
-    plantuml_code = plantuml_code.strip()
-    
-    # Убеждаемся, что код начинается с @startuml и заканчивается @enduml
-    if not plantuml_code.startswith('@start'):
-        plantuml_code = '@startuml\n' + plantuml_code
-    if not plantuml_code.endswith('@enduml'):
-        plantuml_code = plantuml_code + '\n@enduml'
-    
-    # Сжимаем с помощью zlib (deflate)
-    compressed = zlib.compress(plantuml_code.encode('utf-8'), 9)[2:-4]
-    
-    # Специальная base64-подобная кодировка PlantUML
-    # Используем алфавит PlantUML
-    plantuml_alphabet = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_'
-    
-    # Кодируем в специальном формате PlantUML
-    result = []
-    for i in range(0, len(compressed), 3):
-        if i+2 < len(compressed):
-            b1, b2, b3 = compressed[i], compressed[i+1], compressed[i+2]
-            result.append(plantuml_alphabet[b1 >> 2])
-            result.append(plantuml_alphabet[((b1 & 0x3) << 4) | (b2 >> 4)])
-            result.append(plantuml_alphabet[((b2 & 0xF) << 2) | (b3 >> 6)])
-            result.append(plantuml_alphabet[b3 & 0x3F])
-        elif i+1 < len(compressed):
-            b1, b2 = compressed[i], compressed[i+1]
-            result.append(plantuml_alphabet[b1 >> 2])
-            result.append(plantuml_alphabet[((b1 & 0x3) << 4) | (b2 >> 4)])
-            result.append(plantuml_alphabet[(b2 & 0xF) << 2])
-        else:
-            b1 = compressed[i]
-            result.append(plantuml_alphabet[b1 >> 2])
-            result.append(plantuml_alphabet[(b1 & 0x3) << 4])
+    Использует специальный формат кодирования PlantUML сервера (deflate + base64 с алфавитом PlantUML)
     
-    return ''.join(result)
+    Args:
+        plantuml_code: Код PlantUML
+        wrap: Дополнить код до @startuml ... @enduml; False - кодировать как есть
+    """
+    if wrap:
+        plantuml_code = _wrap_diagram(plantuml_code)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    data = plantuml_code.encode('utf-8')
+    compressed = compressor.compress(data) + compressor.flush()
+    return base64.b64encode(compressed).translate(_B64_TO_PLANTUML).decode('ascii').rstrip('=')
 
 
-# Глобальный экземпляр рендерера
-_renderer = None
+@functools.lru_cache(maxsize=1)
+def _create_renderer() -> PlantUMLRenderer:
+    """Один рендерер (и его процессы PlantUML) на весь процесс Streamlit"""
+    return PlantUMLRenderer()
 
 
 def get_renderer() -> Optional[PlantUMLRenderer]:
     """Получение глобального экземпляра рендерера"""
-    global _renderer
-    if _renderer is None:
-        try:
-            _renderer = PlantUMLRenderer()
-        except RuntimeError as e:
-            st.warning(f"⚠️ {str(e)}")
-            st.info("Будет использован онлайн-рендерер")
-            return None
-    return _renderer
+    import streamlit as st
+    
+    try:
+        return _create_renderer()
+    except RuntimeError as e:
+        st.warning(f"⚠️ {str(e)}")
+        st.info("Будет использован онлайн-рендерер")
+        return None
+
+
+def _render_svg(plantuml_code: str) -> str:
+    """Разметка SVG для встраивания в HTML"""
+    svg_text = _create_renderer().render_to_image(plantuml_code, "svg").decode('utf-8')
+    # XML-пролог внутри HTML не нужен
+    svg_start = svg_text.find('<svg')
+    return svg_text[svg_start:] if svg_start != -1 else svg_text
+
+
+# Онлайн-серверы для запасного рендеринга в браузере; URL = префикс + сжатый код
+_ONLINE_SERVER_PREFIXES_JSON = json.dumps([
+    "https://www.plantuml.com/plantuml/png/",
+    "https://kroki.io/plantuml/png/",
+])
+
+# Шаблоны страниц для components.html; фигурные скобки CSS и JS удвоены для format_map
+_LOCAL_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {{
+            margin: 0;
+            padding: 20px;
+            display: flex;
+            justify-content: center;
+            align-items: flex-start;
+            min-height: 100vh;
+            background-color: #ffffff;
+        }}
+        .plantuml-container {{
+            width: 100%;
+            max-width: 100%;
+            text-align: center;
+        }}
+        .plantuml-container svg {{
+            max-width: 100%;
+            height: auto;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }}
+        .render-info {{
+            color: #4caf50;
+            font-size: 12px;
+            margin-top: 10px;
+        }}
+    </style>
+</head>
+<body>
+    <div class="plantuml-container">
+        {svg_markup}
+        <div class="render-info">✓ Rendered locally</div>
+    </div>
+</body>
+</html>
+"""
+
+_ONLINE_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {{
+            margin: 0;
+            padding: 20px;
+            display: flex;
+            justify-content: center;
+            align-items: flex-start;
+            min-height: 100vh;
+            background-color: #ffffff;
+        }}
+        .plantuml-container {{
+            width: 100%;
+            max-width: 100%;
+            text-align: center;
+        }}
+        .plantuml-container img {{
+            max-width: 100%;
+            height: auto;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }}
+        .error-message {{
+            color: #d32f2f;
+            background-color: #ffebee;
+            padding: 16px;
+            border-radius: 4px;
+            border-left: 4px solid #d32f2f;
+            margin-top: 20px;
+        }}
+        .loading {{
+            color: #666;
+            font-style: italic;
+            margin: 20px 0;
+        }}
+        .render-info {{
+            color: #2196f3;
+            font-size: 12px;
+            margin-top: 10px;
+        }}
+        @keyframes spin {{
+            0% {{ transform: rotate(0deg); }}
+            100% {{ transform: rotate(360deg); }}
+        }}
+        .spinner {{
+            border: 3px solid #f3f3f3;
+            border-top: 3px solid #2196f3;
+            border-radius: 50%;
+            width: 30px;
+            height: 30px;
+            animation: spin 1s linear infinite;
+            margin: 20px auto;
+        }}
+        .code-preview {{
+            background-color: #f5f5f5;
+            padding: 10px;
+            border-radius: 4px;
+            font-family: monospace;
+            font-size: 12px;
+            text-align: left;
+            margin-top: 10px;
+            max-height: 200px;
+            overflow-y: auto;
+            display: none;
+        }}
+    </style>
+</head>
+<body>
+    <div class="plantuml-container">
+        <div id="loading-{diagram_id}" class="loading">
+            <div class="spinner"></div>
+            Загрузка диаграммы...
+        </div>
+        <img id="diagram-{diagram_id}" style="display:none;" alt="PlantUML Diagram">
+        <div id="render-info-{diagram_id}" class="render-info" style="display:none;">
+            ✓ Rendered online
+        </div>
+        <div id="error-{diagram_id}" class="error-message" style="display:none;">
+            <strong>Ошибка загрузки диаграммы PlantUML</strong><br><br>
+            Возможные причины:<br>
+            • Проблемы с подключением к серверу PlantUML<br>
+            • Некорректный синтаксис PlantUML кода<br>
+            • Слишком большая диаграмма для онлайн-рендеринга<br><br>
+            <details>
+                <summary>Показать код диаграммы</summary>
+                <pre style="text-align: left; margin-top: 10px; background: #f5f5f5; padding: 10px; border-radius: 4px;">{escaped_code}</pre>
+            </details>
+        </div>
+    </div>
+    <script>
+        const encoded = '{encoded}';
+        const servers = {server_prefixes}.map(prefix => prefix + encoded);
+        const diagramId = '{diagram_id}';
+        let currentServer = 0;
+        let failedServers = [];
+
+        function loadDiagram() {{
+            if (currentServer >= servers.length) {{
+                console.error('All servers failed:', failedServers);
+                document.getElementById('loading-' + diagramId).style.display = 'none';
+                document.getElementById('error-' + diagramId).style.display = 'block';
+                return;
+            }}
+
+            const img = document.getElementById('diagram-' + diagramId);
+            const loading = document.getElementById('loading-' + diagramId);
+            const renderInfo = document.getElementById('render-info-' + diagramId);
+
+            const currentUrl = servers[currentServer];
+            console.log('Trying server ' + currentServer + ':', currentUrl);
+
+            img.onload = function() {{
+                console.log('Successfully loaded from server ' + currentServer);
+                loading.style.display = 'none';
+                img.style.display = 'block';
+                renderInfo.style.display = 'block';
+            }};
+
+            img.onerror = function() {{
+                console.log('Failed to load from server ' + currentServer + ':', currentUrl);
+                failedServers.push(currentUrl);
+                currentServer++;
+                setTimeout(() => loadDiagram(), 500);
+            }};
+
+            img.src = currentUrl;
+        }}
+
+        // Начинаем загрузку с небольшой задержкой
+        setTimeout(() => loadDiagram(), 100);
+    </script>
+</body>
+</html>
+"""
+
+
+@functools.lru_cache(maxsize=128)
+def _build_local_html(plantuml_code: str) -> str:
+    """Страница с локально отрендеренной диаграммой, запомненная между перезапусками скрипта Streamlit"""
+    # SVG встраивается в страницу как есть: без PNG-кодирования и base64
+    return _LOCAL_HTML_TEMPLATE.format_map({"svg_markup": _render_svg(plantuml_code)})
+
+
+@functools.lru_cache(maxsize=128)
+def _build_online_html(plantuml_code: str) -> str:
+    """Страница с онлайн-рендерингом в браузере, запомненная между перезапусками скрипта Streamlit"""
+    return _ONLINE_HTML_TEMPLATE.format_map({
+        "diagram_id": hashlib.blake2b(plantuml_code.encode(), digest_size=4).hexdigest(),
+        # Код для показа при ошибке экранируется за один проход (включая &)
+        "escaped_code": html.escape(plantuml_code),
+        # Сжатый формат дает URL в разы короче URL-кодированного текста
+        "encoded": encode_plantuml_compressed(plantuml_code),
+        "server_prefixes": _ONLINE_SERVER_PREFIXES_JSON,
+    })
 
 
 def render_plantuml(plantuml_code: str, height: int = 500, use_local: bool = True):
@@ -217,69 +808,18 @@ def render_plantuml(plantuml_code: str, height: int = 500, use_local: bool = Tru
         height: Высота контейнера для диаграммы
         use_local: Использовать локальный рендерер, если доступен
     """
+    import streamlit as st
     import streamlit.components.v1 as components
     
     if not plantuml_code:
         return
     
-    # Генерируем уникальный ID для диаграммы
-    diagram_id = hashlib.md5(plantuml_code.encode()).hexdigest()[:8]
-    
     # Пробуем локальный рендерер
     if use_local:
         renderer = get_renderer()
         if renderer is not None:
             try:
-                # Рендерим в PNG
-                image_data = renderer.render_to_image(plantuml_code, "png")
-                
-                # Кодируем в base64
-                base64_image = base64.b64encode(image_data).decode('utf-8')
-                
-                # Создаем HTML с локально сгенерированным изображением
-                html_code = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <style>
-                        body {{
-                            margin: 0;
-                            padding: 20px;
-                            display: flex;
-                            justify-content: center;
-                            align-items: flex-start;
-                            min-height: 100vh;
-                            background-color: #ffffff;
-                        }}
-                        .plantuml-container {{
-                            width: 100%;
-                            max-width: 100%;
-                            text-align: center;
-                        }}
-                        .plantuml-container img {{
-                            max-width: 100%;
-                            height: auto;
-                            border: 1px solid #ddd;
-                            border-radius: 4px;
-                            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                        }}
-                        .render-info {{
-                            color: #4caf50;
-                            font-size: 12px;
-                            margin-top: 10px;
-                        }}
-                    </style>
-                </head>
-                <body>
-                    <div class="plantuml-container">
-                        <img src="data:image/png;base64,{base64_image}" alt="PlantUML Diagram">
-                        <div class="render-info">✓ Rendered locally</div>
-                    </div>
-                </body>
-                </html>
-                """
-                
+                html_code = _build_local_html(plantuml_code)
                 components.html(html_code, height=height, scrolling=True)
                 return
                 
@@ -288,164 +828,13 @@ def render_plantuml(plantuml_code: str, height: int = 500, use_local: bool = Tru
                 st.info("Используется онлайн-рендерер")
     
     # Запасной вариант: онлайн рендеринг
-    # Используем два подхода - текстовый формат и сжатый
     try:
-        # Для основного сервера используем текстовый формат с префиксом ~1
-        text_encoded = encode_plantuml_text(plantuml_code)
-        # Для альтернативных серверов пробуем сжатый формат
-        compressed_encoded = encode_plantuml_compressed(plantuml_code)
+        html_code = _build_online_html(plantuml_code)
     except Exception as e:
         st.error(f"Ошибка кодирования PlantUML: {e}")
         st.code(plantuml_code, language="text")
         return
     
-    # Используем несколько альтернативных серверов и форматов
-    # ~1 префикс указывает на текстовый формат
-    servers = [
-        f"https://www.plantuml.com/plantuml/png/~1{text_encoded}",
-        f"https://www.plantuml.com/plantuml/png/{compressed_encoded}",
-        f"https://kroki.io/plantuml/png/{compressed_encoded}",
-    ]
-    
-    html_code = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                margin: 0;
-                padding: 20px;
-                display: flex;
-                justify-content: center;
-                align-items: flex-start;
-                min-height: 100vh;
-                background-color: #ffffff;
-            }}
-            .plantuml-container {{
-                width: 100%;
-                max-width: 100%;
-                text-align: center;
-            }}
-            .plantuml-container img {{
-                max-width: 100%;
-                height: auto;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }}
-            .error-message {{
-                color: #d32f2f;
-                background-color: #ffebee;
-                padding: 16px;
-                border-radius: 4px;
-                border-left: 4px solid #d32f2f;
-                margin-top: 20px;
-            }}
-            .loading {{
-                color: #666;
-                font-style: italic;
-                margin: 20px 0;
-            }}
-            .render-info {{
-                color: #2196f3;
-                font-size: 12px;
-                margin-top: 10px;
-            }}
-            @keyframes spin {{
-                0% {{ transform: rotate(0deg); }}
-                100% {{ transform: rotate(360deg); }}
-            }}
-            .spinner {{
-                border: 3px solid #f3f3f3;
-                border-top: 3px solid #2196f3;
-                border-radius: 50%;
-                width: 30px;
-                height: 30px;
-                animation: spin 1s linear infinite;
-                margin: 20px auto;
-            }}
-            .code-preview {{
-                background-color: #f5f5f5;
-                padding: 10px;
-                border-radius: 4px;
-                font-family: monospace;
-                font-size: 12px;
-                text-align: left;
-                margin-top: 10px;
-                max-height: 200px;
-                overflow-y: auto;
-                display: none;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="plantuml-container">
-            <div id="loading-{diagram_id}" class="loading">
-                <div class="spinner"></div>
-                Загрузка диаграммы...
-            </div>
-            <img id="diagram-{diagram_id}" style="display:none;" alt="PlantUML Diagram">
-            <div id="render-info-{diagram_id}" class="render-info" style="display:none;">
-                ✓ Rendered online
-            </div>
-            <div id="error-{diagram_id}" class="error-message" style="display:none;">
-                <strong>Ошибка загрузки диаграммы PlantUML</strong><br><br>
-                Возможные причины:<br>
-                • Проблемы с подключением к серверу PlantUML<br>
-                • Некорректный синтаксис PlantUML кода<br>
-                • Слишком большая диаграмма для онлайн-рендеринга<br><br>
-                <details>
-                    <summary>Показать код диаграммы</summary>
-                    <pre style="text-align: left; margin-top: 10px; background: #f5f5f5; padding: 10px; border-radius: 4px;">{plantuml_code.replace('<', '&lt;').replace('>', '&gt;')}</pre>
-                </details>
-            </div>
-        </div>
-        <script>
-            const servers = {servers};
-            const diagramId = '{diagram_id}';
-            let currentServer = 0;
-            let failedServers = [];
-            
-            function loadDiagram() {{
-                if (currentServer >= servers.length) {{
-                    console.error('All servers failed:', failedServers);
-                    document.getElementById('loading-' + diagramId).style.display = 'none';
-                    document.getElementById('error-' + diagramId).style.display = 'block';
-                    return;
-                }}
-                
-                const img = document.getElementById('diagram-' + diagramId);
-                const loading = document.getElementById('loading-' + diagramId);
-                const renderInfo = document.getElementById('render-info-' + diagramId);
-                
-                const currentUrl = servers[currentServer];
-                console.log('Trying server ' + currentServer + ':', currentUrl);
-                
-                img.onload = function() {{
-                    console.log('Successfully loaded from server ' + currentServer);
-                    loading.style.display = 'none';
-                    img.style.display = 'block';
-                    renderInfo.style.display = 'block';
-                }};
-                
-                img.onerror = function() {{
-                    console.log('Failed to load from server ' + currentServer + ':', currentUrl);
-                    failedServers.push(currentUrl);
-                    currentServer++;
-                    setTimeout(() => loadDiagram(), 500);
-                }};
-                
-                img.src = currentUrl;
-            }}
-            
-            // Начинаем загрузку с небольшой задержкой
-            setTimeout(() => loadDiagram(), 100);
-        </script>
-    </body>
-    </html>
-    """
-    
     try:
         components.html(html_code, height=height, scrolling=True)
     except Exception as e:
@@ -470,6 +859,9 @@ def check_requirements() -> dict:
     
     try:
         renderer = PlantUMLRenderer()
+        if not _java_runs(renderer.java_path):
+            info["error"] = f"Java не запускается: {renderer.java_path}"
+            return info
         info.update({
             "java_available": True,
             "java_path": renderer.java_path,
@@ -493,9 +885,9 @@ def download_plantuml_jar(url: str = "https://github.com/plantuml/plantuml/relea
     Returns:
         True если скачивание успешно, иначе False
     """
+    import streamlit as st
+    
     try:
-        import requests
-        
         # Создаем директорию lib если её нет
         lib_dir = "lib"
         os.makedirs(lib_dir, exist_ok=True)
@@ -505,25 +897,50 @@ def download_plantuml_jar(url: str = "https://github.com/plantuml/plantuml/relea
         
         # Скачиваем файл с прогресс-баром
         with st.spinner(f"Скачивание plantuml.jar..."):
-            response = requests.get(url, stream=True, timeout=60)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with open(jar_path, 'wb') as f:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            progress = downloaded / total_size
-                            st.progress(progress)
+            with urllib.request.urlopen(url, timeout=60) as response:
+                total_size = int(response.headers.get('Content-Length') or 0)
+                progress_bar = st.progress(0.0) if total_size > 0 else None
+                shown_percent = 0
+                
+                # Пишем во временный файл: прерванная загрузка не оставит битый plantuml.jar
+                tmp_path = jar_path + '.tmp'
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        downloaded = 0
+                        while True:
+                            chunk = response.read(1 << 20)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            # Прогресс обновляется не чаще, чем на каждый процент
+                            if progress_bar is not None:
+                                percent = min(downloaded * 100 // total_size, 100)
+                                if percent != shown_percent:
+                                    shown_percent = percent
+                                    progress_bar.progress(percent / 100)
+                    # Оборванное соединение read() не считает ошибкой: сверяем размер сами
+                    if downloaded < total_size:
+                        raise urllib.error.ContentTooShortError(
+                            f"получено {downloaded} из {total_size} байт", None
+                        )
+                    os.replace(tmp_path, jar_path)
+                except BaseException:
+                    # Недокачанный временный файл не остается на диске
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                    raise
         
+        # Поиск jar и готовые страницы закэшированы: забываем то, что было до скачивания
+        _find_plantuml_jar.cache_clear()
+        _build_local_html.cache_clear()
+        _build_online_html.cache_clear()
         st.success(f"✅ Файл plantuml.jar успешно скачан в {jar_path}")
         return True
         
-    except requests.RequestException as e:
+    except (urllib.error.URLError, TimeoutError) as e:
         st.error(f"❌ Ошибка скачивания: {e}")
         return False
     except Exception as e:
@@ -534,6 +951,8 @@ def download_plantuml_jar(url: str = "https://github.com/plantuml/plantuml/relea
 # Тестовая функция для проверки рендеринга
 def test_render():
     """Тестирует рендеринг с простой диаграммой"""
+    import streamlit as st
+    
     test_code = """
     @startuml
     Alice -> Bob: Hello
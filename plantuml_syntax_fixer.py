@@ -7,6 +7,27 @@ import re
 from typing import List, Tuple
 
 
+# Двоеточие перед ключевым словом в начале строки (":if", ":else", ":endif", ":start", ":stop")
+_COLON_KW = re.compile(r'^([^\S\n]*):(if|else|endif|start|stop)\b', re.MULTILINE)
+
+# Пробельные символы в конце строк
+_TRAILING_WS = re.compile(r'[^\S\n]+$', re.MULTILINE)
+
+# Строки, которые после strip() начинаются с "if " и с "endif"
+_IF_LINE = re.compile(r'^[^\S\n]*if [^\S\n]*\S', re.MULTILINE)
+_ENDIF_LINE = re.compile(r'^[^\S\n]*endif', re.MULTILINE)
+
+# Запрещенные ID: " as <id>" (целым словом) или " <id> " внутри строки
+_FORBIDDEN_IDS = ('end', 'click', 'class', 'style', 'subgraph', 'graph', 'flowchart')
+_FORBIDDEN_ID = re.compile(r' (?:as ({0})\b|({0})(?= ))'.format('|'.join(_FORBIDDEN_IDS)))
+
+# Строка "if <условие>" без " then": группа 1 - строка без пробелов в конце
+_IF_WITHOUT_THEN = re.compile(r'^(?![^\n]* then)([^\S\n]*if [^\S\n]*\S[^\n]*?)[^\S\n]*$', re.MULTILINE)
+
+# Строка вида "if (...)" без слова then: группа 1 - строка без пробелов в конце
+_IF_PAREN_WITHOUT_THEN = re.compile(r'^(?![^\n]*then)([^\S\n]*if[^\S\n]*\([^\n]*\))[^\S\n]*$', re.MULTILINE)
+
+
 def fix_plantuml_syntax(plantuml_code: str) -> str:
     """
     Исправляет распространенные синтаксические ошибки в PlantUML коде
@@ -20,47 +41,20 @@ def fix_plantuml_syntax(plantuml_code: str) -> str:
     if not plantuml_code:
         return plantuml_code
     
-    lines = plantuml_code.split('\n')
-    fixed_lines = []
+    # 1. Исправляем "!thme" на "!theme"
+    fixed_code = plantuml_code.replace('!thme', '!theme')
     
-    for line in lines:
-        original_line = line
-        
-        # 1. Исправляем "!thme" на "!theme"
-        if '!thme' in line:
-            line = line.replace('!thme', '!theme')
-        
-        # 2. Убираем двоеточие перед if, else, endif
-        # Ищем паттерны типа ":if", ":else", ":endif"
-        patterns_to_fix = [
-            (r'^\s*:if\b', 'if'),
-            (r'^\s*:else\b', 'else'),
-            (r'^\s*:endif\b', 'endif'),
-            (r'^\s*:start\b', 'start'),
-            (r'^\s*:stop\b', 'stop'),
-        ]
-        
-        for pattern, replacement in patterns_to_fix:
-            if re.match(pattern, line):
-                line = re.sub(pattern, replacement, line)
-                break
-        
-        # 3. Проверяем правильность структуры if-then-endif
-        # Убедимся, что после if есть then
-        if re.match(r'^\s*if\s*\(.*\)\s*$', line) and 'then' not in line:
-            # Добавляем then в конец строки, если его нет
-            line = line.rstrip() + ' then'
-        
-        # 4. Проверяем, что все if имеют соответствующие endif
-        # Это делается на уровне всего кода, а не отдельной строки
-        
-        # 5. Убираем лишние пробелы в начале строки (нормализация отступов)
-        line = line.rstrip()
-        
-        fixed_lines.append(line)
+    # 2. Убираем двоеточие перед if, else, endif, start, stop (одним проходом по всему коду)
+    fixed_code = _COLON_KW.sub(r'\1\2', fixed_code)
+    
+    # 3. Проверяем правильность структуры if-then-endif
+    # Добавляем then в конец строк "if (...)", где его нет
+    fixed_code = _IF_PAREN_WITHOUT_THEN.sub(r'\1 then', fixed_code)
     
-    # 6. Проверка баланса if/endif
-    fixed_code = '\n'.join(fixed_lines)
+    # 4. Убираем лишние пробелы в конце строк
+    fixed_code = _TRAILING_WS.sub('', fixed_code)
+    
+    # 5. Проверка баланса if/endif
     fixed_code = _validate_if_structure(fixed_code)
     
     return fixed_code
@@ -76,41 +70,32 @@ def _validate_if_structure(plantuml_code: str) -> str:
     Returns:
         Исправленный PlantUML код
     """
+    # Без строк "if ..." исправлять нечего
+    if not _IF_LINE.search(plantuml_code):
+        return plantuml_code
+    
     lines = plantuml_code.split('\n')
-    fixed_lines = []
-    if_stack = []
+    depth = 0
     
-    for i, line in enumerate(lines):
+    for line in lines:
         stripped_line = line.strip()
-        
-        # Проверяем на начало блока if
         if stripped_line.startswith('if '):
-            if_stack.append(i)
-        
-        # Проверяем на конец блока if
-        elif stripped_line.startswith('endif'):
-            if if_stack:
-                if_stack.pop()
-        
-        # Добавляем then, если if не имеет then
-        elif stripped_line.startswith('if ') and ' then' not in stripped_line:
-            lines[i] = line.rstrip() + ' then'
-        
-        fixed_lines.append(lines[i])
+            depth += 1
+        elif stripped_line.startswith('endif') and depth:
+            depth -= 1
+    
+    if not depth:
+        return plantuml_code
     
-    # Если остались незакрытые if, добавляем endif
-    for if_line_index in if_stack:
-        # Находим соответствующий if и добавляем после него endif
-        for i in range(if_line_index + 1, len(fixed_lines)):
-            if fixed_lines[i].strip():
-                # Вставляем endif перед следующей непустой строкой
-                fixed_lines.insert(i, 'endif')
-                break
-        else:
-            # Если нет следующих непустых строк, добавляем в конец
-            fixed_lines.append('endif')
+    # Незакрытые if закрываются перед последним @enduml, а если его нет - в конце кода
+    insert_at = len(lines)
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].strip().startswith('@enduml'):
+            insert_at = i
+            break
+    lines[insert_at:insert_at] = ['endif'] * depth
     
-    return '\n'.join(fixed_lines)
+    return '\n'.join(lines)
 
 
 def validate_plantuml_syntax(plantuml_code: str) -> Tuple[bool, List[str]]:
@@ -129,53 +114,29 @@ def validate_plantuml_syntax(plantuml_code: str) -> Tuple[bool, List[str]]:
         errors.append("Пустой PlantUML код")
         return False, errors
     
-    lines = plantuml_code.split('\n')
-    
     # Проверка наличия @startuml и @enduml
-    has_start = any('@startuml' in line for line in lines)
-    has_end = any('@enduml' in line for line in lines)
-    
-    if not has_start:
+    if '@startuml' not in plantuml_code:
         errors.append("Отсутствует @startuml")
-    if not has_end:
+    if '@enduml' not in plantuml_code:
         errors.append("Отсутствует @enduml")
     
     # Проверка баланса if/endif
-    if_count = 0
-    endif_count = 0
-    
-    for line in lines:
-        stripped_line = line.strip()
-        if stripped_line.startswith('if '):
-            if_count += 1
-        elif stripped_line.startswith('endif'):
-            endif_count += 1
+    if_count = len(_IF_LINE.findall(plantuml_code))
+    endif_count = len(_ENDIF_LINE.findall(plantuml_code))
     
     if if_count != endif_count:
         errors.append(f"Несоответствие количества if ({if_count}) и endif ({endif_count})")
     
-    # Проверка на запрещенные слова в ID
-    forbidden_ids = ['end', 'click', 'class', 'style', 'subgraph', 'graph', 'flowchart']
-    for line in lines:
-        for forbidden_id in forbidden_ids:
-            if f' as {forbidden_id}' in line or f' {forbidden_id} ' in line:
-                errors.append(f"Использование запрещенного ID: {forbidden_id}")
-                break
+    # Проверка на запрещенные слова в ID: один проход по всему коду, каждый ID - одна ошибка
+    forbidden_found = dict.fromkeys(
+        match.group(1) or match.group(2) for match in _FORBIDDEN_ID.finditer(plantuml_code)
+    )
+    for forbidden_id in forbidden_found:
+        errors.append(f"Использование запрещенного ID: {forbidden_id}")
     
     # Проверка на наличие двоеточий перед ключевыми словами
-    problematic_patterns = [
-        (r'^\s*:if\b', 'Двоеточие перед if'),
-        (r'^\s*:else\b', 'Двоеточие перед else'),
-        (r'^\s*:endif\b', 'Двоеточие перед endif'),
-        (r'^\s*:start\b', 'Двоеточие перед start'),
-        (r'^\s*:stop\b', 'Двоеточие перед stop'),
-    ]
-    
-    for line in lines:
-        for pattern, error_msg in problematic_patterns:
-            if re.match(pattern, line):
-                errors.append(error_msg)
-                break
+    for match in _COLON_KW.finditer(plantuml_code):
+        errors.append(f"Двоеточие перед {match.group(2)}")
     
     # Проверка на "!thme" вместо "!theme"
     if '!thme' in plantuml_code:
@@ -205,38 +166,20 @@ def auto_fix_plantuml(plantuml_code: str) -> Tuple[str, List[str]]:
         original_code = fixed_code
         
         # 1. Исправляем "!thme" на "!theme"
-        if '!thme' in fixed_code:
+        thme_count = fixed_code.count('!thme')
+        if thme_count:
             fixed_code = fixed_code.replace('!thme', '!theme')
-            fixes_applied.append("Исправлено '!thme' на '!theme'")
+            fixes_applied.append(f"Исправлено '!thme' на '!theme' (вхождений: {thme_count})")
         
         # 2. Убираем двоеточия перед ключевыми словами
-        patterns_to_fix = [
-            (r'^(\s*):if\b', r'\1if'),
-            (r'^(\s*):else\b', r'\1else'),
-            (r'^(\s*):endif\b', r'\1endif'),
-            (r'^(\s*):start\b', r'\1start'),
-            (r'^(\s*):stop\b', r'\1stop'),
-        ]
-        
-        for pattern, replacement in patterns_to_fix:
-            fixed_lines = []
-            for line in fixed_code.split('\n'):
-                new_line = re.sub(pattern, replacement, line)
-                if new_line != line:
-                    fixes_applied.append(f"Убрано двоеточие перед ключевым словом в строке: {line.strip()}")
-                fixed_lines.append(new_line)
-            fixed_code = '\n'.join(fixed_lines)
+        fixed_code, colon_count = _COLON_KW.subn(r'\1\2', fixed_code)
+        if colon_count:
+            fixes_applied.append(f"Убрано двоеточие перед ключевыми словами (строк: {colon_count})")
         
         # 3. Добавляем then после if, если его нет
-        if_lines = []
-        lines = fixed_code.split('\n')
-        for i, line in enumerate(lines):
-            if line.strip().startswith('if ') and ' then' not in line:
-                if_lines.append(i)
-                lines[i] = line.rstrip() + ' then'
-                fixes_applied.append(f"Добавлено 'then' после if в строке: {line.strip()}")
-        
-        fixed_code = '\n'.join(lines)
+        fixed_code, then_count = _IF_WITHOUT_THEN.subn(r'\1 then', fixed_code)
+        if then_count:
+            fixes_applied.append(f"Добавлено 'then' после if (строк: {then_count})")
         
         # 4. Проверяем и исправляем баланс if/endif
         fixed_code = _validate_if_structure(fixed_code)
@@ -5,35 +5,51 @@
 
 import os
 import sys
-from dotenv import load_dotenv
+# .env загружается при импорте gigachat_client
 from gigachat_client import GigaChatClient
 
-# Загружаем переменные окружения
-load_dotenv()
+# Заголовок собирается один раз при загрузке модуля
+_BANNER = "🔧 Диагностика подключения к GigaChat API\n" + "=" * 50
+
+# Подпись статуса переменной по признаку bool(значение)
+_STATUS = ("❌ Не установлен", "✅ Установлен")
+
+# Отчет о переменных окружения собирается за один вызов format
+_ENV_REPORT = (
+    "   GIGACHAT_API_URL: {api_url}\n"
+    "   GIGACHAT_CLIENT_ID: {client_id}\n"
+    "   GIGACHAT_CLIENT_SECRET: {client_secret}\n"
+    "   GIGACHAT_AUTH_KEY: {auth_key}"
+)
 
 def main():
-    print("🔧 Диагностика подключения к GigaChat API")
-    print("=" * 50)
+    print(_BANNER)
 
     # Проверяем переменные окружения
     print("📋 Проверка переменных окружения:")
-    api_url = os.getenv("GIGACHAT_API_URL")
-    client_id = os.getenv("GIGACHAT_CLIENT_ID")
-    client_secret = os.getenv("GIGACHAT_CLIENT_SECRET")
-    auth_key = os.getenv("GIGACHAT_AUTH_KEY")
+    env = os.environ
+    api_url = env.get("GIGACHAT_API_URL")
+    client_id = env.get("GIGACHAT_CLIENT_ID")
+    client_secret = env.get("GIGACHAT_CLIENT_SECRET")
+    auth_key = env.get("GIGACHAT_AUTH_KEY")
 
-    print(f"   GIGACHAT_API_URL: {api_url}")
-    print(f"   GIGACHAT_CLIENT_ID: {'✅ Установлен' if client_id else '❌ Не установлен'}")
-    print(f"   GIGACHAT_CLIENT_SECRET: {'✅ Установлен' if client_secret else '❌ Не установлен'}")
-    print(f"   GIGACHAT_AUTH_KEY: {'✅ Установлен' if auth_key else '❌ Не установлен'}")
+    # Блоки текста выводятся одной записью в stdout
+    print(_ENV_REPORT.format(
+        api_url=api_url,
+        client_id=_STATUS[bool(client_id)],
+        client_secret=_STATUS[bool(client_secret)],
+        auth_key=_STATUS[bool(auth_key)],
+    ))
 
     if not (client_id and client_secret) and not auth_key:
-        print("\n❌ Ошибка: Не установлены API ключи!")
-        print("📖 Инструкция:")
-        print("1. Зарегистрируйтесь в https://developers.sber.ru/")
-        print("2. Создайте проект в разделе GigaChat API")
-        print("3. Получите Client ID и Client Secret")
-        print("4. Вставьте их в файл .env")
+        print("\n".join((
+            "\n❌ Ошибка: Не установлены API ключи!",
+            "📖 Инструкция:",
+            "1. Зарегистрируйтесь в https://developers.sber.ru/",
+            "2. Создайте проект в разделе GigaChat API",
+            "3. Получите Client ID и Client Secret",
+            "4. Вставьте их в файл .env",
+        )))
         return
 
     # Создаем клиент и тестируем подключение
@@ -47,17 +63,19 @@ def main():
         else:
             print("\n❌ Подключение не удалось.")
     except Exception as e:
-        print(f"\n❌ Критическая ошибка: {str(e)}")
-        print("\n🔍 Возможные причины:")
-        print("1. Неверные API ключи")
-        print("2. Ключи деактивированы в личном кабинете")
-        print("3. Превышен лимит запросов")
-        print("4. Аккаунт не активирован для использования API")
-        print("\n💡 Рекомендации:")
-        print("1. Проверьте правильность ключей в личном кабинете Sber AI")
-        print("2. Убедитесь, что проект активен")
-        print("3. Проверьте баланс токенов")
-        print("4. Свяжитесь с поддержкой Sber AI")
+        print("\n".join((
+            f"\n❌ Критическая ошибка: {str(e)}",
+            "\n🔍 Возможные причины:",
+            "1. Неверные API ключи",
+            "2. Ключи деактивированы в личном кабинете",
+            "3. Превышен лимит запросов",
+            "4. Аккаунт не активирован для использования API",
+            "\n💡 Рекомендации:",
+            "1. Проверьте правильность ключей в личном кабинете Sber AI",
+            "2. Убедитесь, что проект активен",
+            "3. Проверьте баланс токенов",
+            "4. Свяжитесь с поддержкой Sber AI",
+        )))
 
 if __name__ == "__main__":
     main()